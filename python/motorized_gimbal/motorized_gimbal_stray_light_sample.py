@@ -13,6 +13,12 @@ Dependencies:
     - zaber-motion Python ASCII library:
         https://www.zaber.com/software/docs/motion-library/ascii/tutorials/install/py/
         Can be installed using "pip" via the following command: pip install zaber-motion
+    - numpy, imageio, and tifffile Python libraries, for handling and saving captured images:
+        Can be installed using "pip" via the following command: pip install numpy imageio tifffile
+    - (Optional) tqdm Python library, for displaying a progress bar while capturing:
+        Can be installed using "pip" via the following command: pip install tqdm
+    - (Optional) orjson Python library, for faster writing of the capture config file:
+        Can be installed using "pip" via the following command: pip install orjson
     - (Optional) Imatest IT library
         https://www.imatest.com/docs/imatest-it-instructions/#Python
 
@@ -22,50 +28,284 @@ Imatest Stray Light (Flare) Documentation:
 Imatest LLC, 2022
 """
 from zaber_motion import Units, Library
-from zaber_motion.ascii import Connection
+from zaber_motion.ascii import Axis, Connection
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import multiprocessing
+import os
 import pathlib
+import tempfile
+import threading
 import time
 import typing
 import json
+import numpy
+
+
+def _json_default(obj: typing.Any) -> typing.Any:
+    # Convert objects that aren't natively JSON-serializable: numpy values (e.g., angles from numpy.arange) to Python
+    # numbers/lists, and paths to str
+    if isinstance(obj, (numpy.generic, numpy.ndarray)):
+        return obj.tolist()
+    if isinstance(obj, pathlib.PurePath):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# JSON encoding/decoding: use the faster orjson library if it is installed, otherwise the built-in json module
+try:
+    import orjson
+
+    def _json_dumps(obj: typing.Any) -> bytes:
+        return orjson.dumps(
+            obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY
+        )
+
+    _json_loads = orjson.loads
+except ImportError:
+
+    def _json_dumps(obj: typing.Any) -> bytes:
+        return json.dumps(obj, default=_json_default).encode()
+
+    _json_loads = json.loads
+
+# Progress bar: use the tqdm library if it is installed, otherwise no progress bar is displayed
+try:
+    from tqdm import tqdm
+    from tqdm.contrib.logging import logging_redirect_tqdm
+except ImportError:
+    tqdm = None
+
+logger = logging.getLogger(__name__)
 
 # Type aliases
 CapturePlanType = typing.Dict[str, typing.List[float]]
 
+# Default velocity (degrees per second) of the Motorized Gimbal movements, which is also used to estimate the pause time
+# after each movement (see get_settle_time_s)
+DEFAULT_VELOCITY_DEG_PER_S = 50
+
+# Zaber connection state that is kept between calls to run_sample_mg_capture_plan() within the same Python process:
+# Whether Library.enable_device_db_store() has already been called
+_device_db_store_enabled = False
+# Addresses of the Zaber devices detected on each COM port, in the order returned by Connection.detect_devices()
+_detected_device_addresses: typing.Dict[str, typing.List[int]] = dict()
+
+
+def acquire_image() -> typing.Optional[numpy.ndarray]:
+    """
+    Acquire an image from the camera
+
+    Returns
+    -------
+    image : numpy.ndarray or None
+        Acquired image, e.g., an array with shape (rows, columns) or (rows, columns, channels). None if no image was
+        acquired.
+
+    Notes
+    -----
+    * The contents of this function should be overwritten to call the desired image acquisition command, which should
+      return the acquired image as a numpy array.
+    * Saving the image is done separately by save_image(), on a worker thread, so this function should return as soon
+      as the image has been acquired. The Motorized Gimbal does not move until this function has returned.
+    * Each call must return a new array, not a reused or preallocated camera buffer (e.g., the array of a grab result
+      that is returned to the camera's buffer pool). Up to max_pending_saves previously returned images may still be
+      waiting to be saved on worker threads when this function is called again, so overwriting a buffer corrupts the
+      saved images. If the camera API reuses its buffers, return a copy, e.g., image = buffer.copy().
+    * As written, no image is acquired and None is returned, in which case no image file is saved.
+
+    See Also
+    --------
+    save_image : Save an image file to a specified path
+    run_sample_mg_capture_plan : Run a sample Motorized Gimbal capture plan
+    """
+    image = None
+
+    # ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! !
+    pass  # REMOVE "pass" and INSERT IMAGE ACQUISITION COMMAND HERE, e.g., image = camera.grab_image()
+    # ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! !
 
-def capture_image(im_file_path: pathlib.Path) -> None:
+    return image
+
+
+def save_image(im_file_path: str, image: typing.Optional[numpy.ndarray]) -> None:
     """
-    Capture and save an image file to a specified path
+    Save an image file to a specified path
 
     Parameters
     ----------
-    im_file_path : pathlib.Path
+    im_file_path : str
         Path to output file image file, including file extension
+    image : numpy.ndarray or None
+        Image to save, as returned by acquire_image(). If None, no image file is saved.
 
     Notes
     -----
-    * The contents of this function should be overwritten to call the desired image capture command which should save an
-      image file as the input path (im_file_path).
-    * The as-written im_file_path is constructed in the run_sample_mg_capture_plan() function and is formatted with the
-      Python "pathlib.Path" module to be, for example: WindowsPath('C:/path/to/output_dir/cap00001.png')
+    * The image file format is determined by the file extension of im_file_path:
+        - "tif" or "tiff": uncompressed TIFF, which is fast to save and can be read by Imatest
+        - "npy": numpy array file, which is fast to save but must be converted before analysis with Imatest
+        - "raw": raw pixel data without a header, with the array shape and data type saved to a JSON-encoded sidecar
+          file (e.g., "cap00001.raw.json"). This is the fastest to save but must be converted before analysis with
+          Imatest.
+        - Any other extension, e.g., "png": saved using imageio. Compressed formats such as PNG take considerably longer
+          to save than uncompressed formats, especially for high resolution images.
+    * The as-written im_file_path is constructed in the run_sample_mg_capture_plan() function as an absolute path with
+      forward slashes, for example: 'C:/path/to/output_dir/cap00001.tif'
 
     See Also
     --------
+    acquire_image : Acquire an image from the camera
     run_sample_mg_capture_plan : Run a sample Motorized Gimbal capture plan
     """
-    # convert pathlib.Path object to str:
-    image_file_path_str = im_file_path.resolve().as_posix()
+    if image is None:  # No image was acquired
+        return
 
-    # ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! !
-    pass  # REMOVE "pass" and INSERT IMAGE CAPTURE COMMAND HERE
-    # ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! ! !
+    im_file_ext = os.path.splitext(im_file_path)[1].lower().lstrip(".")
+    if im_file_ext in ("tif", "tiff"):
+        import tifffile
+
+        tifffile.imwrite(im_file_path, image, compression=None)
+    elif im_file_ext == "npy":
+        numpy.save(im_file_path, image)
+    elif im_file_ext == "raw":
+        image.tofile(im_file_path)
+        with open(im_file_path + ".json", mode="wb") as sidecar_file:
+            sidecar_file.write(
+                _json_dumps(dict({"shape": image.shape, "dtype": image.dtype.str}))
+            )
+    else:
+        import imageio.v3 as iio
 
+        iio.imwrite(im_file_path, image)
 
-def run_sl_analysis(
-    config_file_path: pathlib.Path = pathlib.Path(""),
-    ini_file_path: pathlib.Path = pathlib.Path(""),
-) -> int:
+
+def check_image_writer(im_file_ext: str) -> str:
     """
-    Run stray light analysis using the Imatest IT interface
+    Check that the library used by save_image() to save image files with the specified file extension is installed
+
+    Parameters
+    ----------
+    im_file_ext : str
+        Image file extension to use for captures, e.g., "tif"
+
+    Returns
+    -------
+    im_file_ext : str
+        Image file extension to use for captures: the input im_file_ext, or "png" if TIFF was specified but the tifffile
+        library isn't installed
+
+    Raises
+    ------
+    ImportError
+        If the imageio library is required but isn't installed
+
+    Notes
+    -----
+    * save_image() is called on worker threads, so this function should be called before capturing any images, so that
+      a missing library is reported before moving the Motorized Gimbal rather than after the capture plan has run.
+    """
+    if im_file_ext.lower() in ("tif", "tiff"):
+        try:
+            import tifffile  # noqa: F401
+
+            return im_file_ext
+        except ImportError:
+            logger.warning(
+                'The tifffile library is not installed. Saving image files as "png" instead of "%s".',
+                im_file_ext,
+            )
+            im_file_ext = "png"
+
+    if im_file_ext.lower() not in ("npy", "raw"):
+        import imageio.v3  # noqa: F401
+
+    return im_file_ext
+
+
+def move_axes_absolute(
+    axis_angles: typing.Sequence[typing.Tuple[Axis, float]],
+    velocity: float = DEFAULT_VELOCITY_DEG_PER_S,
+    acceleration: float = 50,
+) -> None:
+    """
+    Move Motorized Gimbal axes to absolute angles simultaneously and wait until all axes are done moving
+
+    Parameters
+    ----------
+    axis_angles : typing.Sequence[typing.Tuple[Axis, float]]
+        Zaber axes to move, each paired with the absolute angle (degrees) to move it to
+    velocity : float
+        Velocity (degrees per second) of the movements
+    acceleration : float
+        Acceleration (degrees per second squared) of the movements
+
+    Notes
+    -----
+    * All movement commands are sent back-to-back before waiting on any axis, so the total time is that of the longest
+      movement. Waiting on an axis that has already finished moving only costs a single status query.
+    """
+    for axis, angle in axis_angles:
+        axis.move_absolute(
+            angle,
+            Units.ANGLE_DEGREES,
+            wait_until_idle=False,
+            velocity=velocity,
+            acceleration=acceleration,
+            velocity_unit=Units.ANGULAR_VELOCITY_DEGREES_PER_SECOND,
+            acceleration_unit=Units.ANGULAR_ACCELERATION_DEGREES_PER_SECOND_SQUARED,
+        )
+    for axis, _ in axis_angles:
+        axis.wait_until_idle()
+
+
+def get_settle_time_s(
+    axis_displacements_deg: typing.Sequence[float],
+    max_settle_time_s: float,
+    velocity: float = DEFAULT_VELOCITY_DEG_PER_S,
+    min_settle_time_s: float = 0.05,
+) -> float:
+    """
+    Get the pause time (seconds) for the Motorized Gimbal to settle after a movement, before image capture
+
+    Parameters
+    ----------
+    axis_displacements_deg : typing.Sequence[float]
+        Absolute displacement (degrees) of each axis that moved. Use float("inf") if the displacement is unknown, e.g.,
+        for the first movement.
+    max_settle_time_s : float
+        Maximum pause time (seconds)
+    velocity : float
+        Velocity (degrees per second) of the movements, which should be the velocity passed to move_axes_absolute()
+    min_settle_time_s : float
+        Minimum pause time (seconds) after any movement
+
+    Returns
+    -------
+    settle_time_s : float
+        Pause time (seconds), which is 0 if no axis moved
+
+    Notes
+    -----
+    * The pause time scales with the largest displacement, since larger movements cause more vibration of the camera
+      and its mount, and is bounded by max_settle_time_s.
+    """
+    if not axis_displacements_deg:  # No axis moved
+        return 0.0
+
+    return min(
+        max_settle_time_s, max(axis_displacements_deg) / velocity + min_settle_time_s
+    )
+
+
+def run_sl_batch(
+    config_file_path: pathlib.Path,
+    ini_file_path: pathlib.Path,
+    max_license_retries: int = 0,
+) -> typing.Tuple[int, typing.Optional[str]]:
+    """
+    Run stray light analysis of a single config file using the Imatest IT interface
 
     Parameters
     ----------
@@ -73,16 +313,102 @@ def run_sl_analysis(
         Path to the config file (JSON-encoded text file) associated with the captured images to analyze
     ini_file_path : pathlib.Path
         Path to an Imatest INI file that defines the [straylight] settings to use for analysis
+    max_license_retries : int
+        Maximum number of times to retry the analysis if all floating license seats are in use, waiting 1, 2, 4, ...
+        seconds between retries
     Returns
     -------
     exit_code: int
         Exit code representing success (0) or failure (1) to run analysis, e.g., to use for the Python exit() command
+    result: str or None
+        JSON-encoded object that lists the file paths to all outputs that were generated. None if analysis failed.
+
+    Notes
+    -----
+    * The Imatest Library is initialized and terminated by this function, so it should only be called once per process.
+
+    See Also
+    --------
+    run_sl_analysis : Run stray light analysis using the Imatest IT interface
     """
     from imatest.it import (
         ImatestLibrary,
         ImatestException,
     )
 
+    exit_code = 0  # 0 = ok, 1 = not ok
+    result = None
+
+    # Initialize Imatest Library
+    # Note: The ImatestLibrary should only be instantiated once per process
+    imatest = ImatestLibrary()
+
+    # Call to stray_light_batch module with ini file argument and StrayLightConfig (object/file) argument.
+    for retry_idx in range(max_license_retries + 1):
+        try:
+            result = imatest.stray_light_batch(
+                ini_file=ini_file_path.resolve().as_posix(),
+                config=config_file_path.resolve().as_posix(),
+            )  # paths are converted to absolute paths (resolve) and to strings with forward slashes (as_posix)
+        except ImatestException as iex:
+            if iex.error_id == ImatestException.FloatingLicenseException:
+                if retry_idx < max_license_retries:
+                    retry_delay_s = 2**retry_idx
+                    print(
+                        f"All floating license seats are in use.  Retrying in {retry_delay_s} seconds..."
+                    )
+                    time.sleep(retry_delay_s)
+                    continue
+                print(
+                    "All floating license seats are in use.  Exit Imatest on another computer and try again."
+                )
+            elif iex.error_id == ImatestException.LicenseException:
+                print("License Exception: " + iex.message)
+            else:
+                print(iex.message)
+
+            exit_code = iex.error_id
+        except Exception as ex:
+            print(str(ex))
+            exit_code = 1
+        break
+
+    # When finished terminate the library
+    imatest.terminate_library()
+
+    return exit_code, result
+
+
+def run_sl_analysis(
+    config_file_path: pathlib.Path = pathlib.Path(""),
+    ini_file_path: pathlib.Path = pathlib.Path(""),
+    num_workers: int = 1,
+    max_license_retries: typing.Optional[int] = None,
+) -> int:
+    """
+    Run stray light analysis using the Imatest IT interface
+
+    Parameters
+    ----------
+    config_file_path : pathlib.Path
+        Path to the config file (JSON-encoded text file) associated with the captured images to analyze
+    ini_file_path : pathlib.Path
+        Path to an Imatest INI file that defines the [straylight] settings to use for analysis
+    num_workers : int
+        Maximum number of processes to run analysis in parallel. If greater than 1, the captures are split by azimuth
+        angle into separate config files (shards), which are written to a new directory next to config_file_path and
+        analyzed in parallel, each producing its own outputs. The results of all shards are merged. The shard config
+        files are deleted afterwards, while the directory is kept if any outputs were written to it. Each process uses
+        an Imatest IT license seat.
+    max_license_retries : int or None
+        Maximum number of times to retry the analysis (of each shard) if all floating license seats are in use, waiting
+        1, 2, 4, ... seconds between retries. If None, retries are only done when analyzing shards in parallel (3
+        retries), since the shards compete for license seats.
+    Returns
+    -------
+    exit_code: int
+        Exit code representing success (0) or failure (1) to run analysis, e.g., to use for the Python exit() command
+    """
     exit_code = 0  # 0 = ok, 1 = not ok
 
     # Check if input files exist
@@ -96,36 +422,99 @@ def run_sl_analysis(
         exit_code = 1
         return exit_code
 
-    # Initialize Imatest Library
-    # Note: The ImatestLibrary should only be instantiated once per process
-    imatest = ImatestLibrary()
+    # Split the captures into groups with the same azimuth angle, in order of first appearance
+    with config_file_path.open(mode="rb") as config_file:
+        config = _json_loads(config_file.read())
+    azimuth_captures: typing.Dict[float, typing.List[typing.Any]] = dict()
+    for capture in config["captures"]:
+        azimuth_captures.setdefault(capture["source_azimuth_angle_deg"], []).append(
+            capture
+        )
 
-    # Call to stray_light_batch module with ini file argument and StrayLightConfig (object/file) argument.
-    try:
-        result = imatest.stray_light_batch(
-            ini_file=ini_file_path.resolve().as_posix(),
-            config=config_file_path.resolve().as_posix(),
-        )  # paths are converted to absolute paths (resolve) and to strings with forward slashes (as_posix)
+    num_shards = min(num_workers, len(azimuth_captures))
+    if num_shards <= 1:
+        exit_code, result = run_sl_batch(
+            config_file_path,
+            ini_file_path,
+            0 if max_license_retries is None else max_license_retries,
+        )
 
         # The result is a JSON-encoded object that lists the file paths to all outputs that were generated.
-        print(result)
-    except ImatestException as iex:
-        if iex.error_id == ImatestException.FloatingLicenseException:
-            print(
-                "All floating license seats are in use.  Exit Imatest on another computer and try again."
+        if result is not None:
+            print(result)
+        return exit_code
+
+    # Distribute the azimuth angle groups across the shards, adding each group to the shard with the fewest captures
+    shard_captures: typing.List[typing.List[typing.Any]] = [
+        [] for _ in range(num_shards)
+    ]
+    for captures in azimuth_captures.values():
+        min(shard_captures, key=len).extend(captures)
+
+    # Write a config file for each shard, with a distinct run name, to a new directory next to the config file. Imatest
+    # may write outputs relative to the location of the config file, so the directory is not deleted along with the
+    # shard config files, unless it is empty.
+    run_name = config.get("run_name", config_file_path.stem)
+    shard_dir = pathlib.Path(
+        tempfile.mkdtemp(
+            prefix=f"{config_file_path.stem}_shards_", dir=config_file_path.parent
+        )
+    )
+    shard_config_file_paths = []
+    try:
+        for shard_idx, captures in enumerate(shard_captures, start=1):
+            shard_config = dict(config)
+            shard_config["captures"] = captures
+            shard_config["run_name"] = f"{run_name}_shard{shard_idx}"
+            shard_config_file_path = pathlib.Path(
+                shard_dir,
+                f"{config_file_path.stem}_shard{shard_idx}{config_file_path.suffix}",
             )
-        elif iex.error_id == ImatestException.LicenseException:
-            print("License Exception: " + iex.message)
+            with shard_config_file_path.open(mode="wb") as shard_config_file:
+                shard_config_file.write(_json_dumps(shard_config))
+            shard_config_file_paths.append(shard_config_file_path)
+
+        # Analyze the shards in parallel, using a new process for each shard (maxtasksperchild=1), since the
+        # ImatestLibrary should only be instantiated once per process
+        print(f"Running stray light analysis of {num_shards} shards in parallel...")
+        with multiprocessing.Pool(processes=num_shards, maxtasksperchild=1) as pool:
+            shard_results = pool.starmap(
+                run_sl_batch,
+                [
+                    (
+                        shard_config_file_path,
+                        ini_file_path,
+                        3 if max_license_retries is None else max_license_retries,
+                    )
+                    for shard_config_file_path in shard_config_file_paths
+                ],
+            )
+    finally:
+        for shard_config_file_path in shard_config_file_paths:
+            shard_config_file_path.unlink()
+        with contextlib.suppress(OSError):  # The directory is not empty
+            shard_dir.rmdir()
+
+    # Merge the results of the shards into a single list: the lists of outputs of the shards are concatenated, and other
+    # results are added as list items
+    merged_result: typing.List[typing.Any] = []
+    for _, shard_result in shard_results:
+        if shard_result is None:
+            continue
+        shard_result = _json_loads(shard_result)
+        if isinstance(shard_result, list):
+            merged_result.extend(shard_result)
         else:
-            print(iex.message)
+            merged_result.append(shard_result)
 
-        exit_code = iex.error_id
-    except Exception as ex:
-        print(str(ex))
-        exit_code = 1
+    # The merged result is JSON-encoded, like the result of each shard
+    print(_json_dumps(merged_result).decode())
 
-    # When finished terminate the library
-    imatest.terminate_library()
+    # Return the exit code of the first shard that failed, if any
+    for shard_exit_code, _ in shard_results:
+        if shard_exit_code != 0:
+            exit_code = shard_exit_code
+            break
 
     return exit_code
 
@@ -174,17 +563,68 @@ def make_sample_mg_star_capture_plan() -> CapturePlanType:
     return capture_plan
 
 
+@contextlib.contextmanager
+def open_capture_config_file(
+    capture_config_file_path: pathlib.Path,
+    capture_config: typing.Dict[str, typing.Any],
+) -> typing.Iterator[typing.Callable[[typing.Dict[str, typing.Any]], None]]:
+    """
+    Open a capture config file (JSON-encoded text file) to which the entry for each capture is written as it is taken
+
+    Parameters
+    ----------
+    capture_config_file_path : pathlib.Path
+        Path to the capture config file to write, e.g., "config.slconf"
+    capture_config : typing.Dict[str, typing.Any]
+        Dictionary of the capture config fields other than "captures", e.g., "run_name"
+
+    Yields
+    ------
+    write_capture_entry : typing.Callable[[typing.Dict[str, typing.Any]], None]
+        Function that writes the entry (dictionary) for a single capture to the "captures" list of the capture config
+        file
+
+    Notes
+    -----
+    * Each capture entry is flushed to disk as soon as it is written, and the file is completed when the context is
+      exited, even if an exception occurs. The file therefore remains valid and contains all captures taken so far if
+      a capture plan is interrupted, and the capture entries don't have to be kept in memory.
+    """
+    with capture_config_file_path.open(mode="wb") as capture_config_file:
+        # Write all fields of the capture config, leaving the "captures" list open for the capture entries
+        capture_config_file.write(_json_dumps(capture_config)[:-1] + b', "captures": [')
+        num_capture_entries = 0
+
+        def write_capture_entry(capture_entry: typing.Dict[str, typing.Any]) -> None:
+            nonlocal num_capture_entries
+            if num_capture_entries > 0:
+                capture_config_file.write(b",")
+            capture_config_file.write(b"\n" + _json_dumps(capture_entry))
+            capture_config_file.flush()
+            num_capture_entries += 1
+
+        try:
+            yield write_capture_entry
+        finally:
+            capture_config_file.write(b"\n]}")
+
+
 def run_sample_mg_capture_plan(
     capture_plan: typing.Optional[CapturePlanType] = None,
     output_dir: pathlib.Path = pathlib.Path(""),
-    im_file_ext: str = "png",
+    im_file_ext: str = "tif",
     pause_time_s: float = 0.5,
+    velocity: float = DEFAULT_VELOCITY_DEG_PER_S,
     ref_az: int = 0,
     ref_fa: int = 0,
     do_home: bool = False,
     com_port: str = "COM4",
     az_zaber_device_idx: int = 1,
     fa_zaber_device_idx: int = 0,
+    serpentine_order: bool = True,
+    num_save_workers: int = 2,
+    max_pending_saves: int = 4,
+    skip_detect: bool = True,
 ) -> None:
     """
     Run a sample Motorized Gimbal capture plan
@@ -197,9 +637,13 @@ def run_sample_mg_capture_plan(
         Path to directory for saving image files and other output files to. If empty or if the path doesn't exist, image
         capture will be skipped.
     im_file_ext : str
-        Image file extension to use for captures, e.g., "png"
+        Image file extension to use for captures, e.g., "tif" or "png", which determines the image file format (see
+        save_image). If "tif" is specified but the tifffile library isn't installed, "png" is used instead.
     pause_time_s : float
-        Pause time (seconds) between Motorized Gimbal movement and image capture call
+        Maximum pause time (seconds) between Motorized Gimbal movement and image capture call. The actual pause scales
+        with the size of the movement (see get_settle_time_s), and is skipped if the axes did not move.
+    velocity : float
+        Velocity (degrees per second) of the Motorized Gimbal movements, which is also used to scale the pause time
     ref_az : float
         Reference azimuth angle (degrees) for the Motorized Gimbal, corresponding to the absolute position where the
         camera is aligned with or perpendicular to the light source
@@ -215,25 +659,53 @@ def run_sample_mg_capture_plan(
         Zaber device index corresponding to the Motorized Gimbal axis that controls azimuth angle (roll)
     fa_zaber_device_idx : int
         Zaber device index corresponding to the Motorized Gimbal axis that controls field angle (yaw)
+    serpentine_order : bool
+        Logical that determines whether to reverse the order of the field angles for every other azimuth angle, which
+        avoids a full-range field angle movement between azimuth angles. Captures are numbered in the order in which
+        they are taken; the source angles of each capture are recorded in the capture config file.
+    num_save_workers : int
+        Number of worker threads that save the acquired images to image files
+    max_pending_saves : int
+        Maximum number of acquired images waiting to be saved. If saving images is slower than acquiring them, image
+        acquisition waits until an image has been saved, which limits the memory used by acquired images.
+    skip_detect : bool
+        Logical that determines whether to reuse the Zaber devices detected on com_port by a previous call to this
+        function (within the same Python process), instead of detecting all devices on com_port again. Devices are
+        always detected on the first call for a com_port.
+
+    Notes
+    -----
+    * The movements are driven from the host, one position at a time, rather than uploaded to the controller as a Zaber
+      stream (device-side motion program). Zaber streams can only coordinate axes of a single device, while the
+      azimuth and field angle axes of the Motorized Gimbal are separate Zaber devices. Additionally, image capture is
+      performed by the host (see acquire_image), so each capture has to be synchronized with the host anyway.
     """
     if capture_plan is None:  # Input validation
-        print("No capture_plan specified. Exiting function run_sample_mg_capture_plan.")
+        logger.warning(
+            "No capture_plan specified. Exiting function run_sample_mg_capture_plan."
+        )
         return
 
+    # Absolute path to the output_dir, with forward slashes, from which the paths to all output files are constructed
+    output_dir_str = output_dir.resolve().as_posix()
+
     if output_dir.is_dir():  # Input validation
         do_captures = True
     else:
         do_captures = False
-        print(
-            f'The specified output_dir (path to output directory) does not exist: "{output_dir.resolve().as_posix()}"\nImage capture will be skipped.'
+        logger.warning(
+            'The specified output_dir (path to output directory) does not exist: "%s"\nImage capture and writing the configuration file will be skipped.',
+            output_dir_str,
         )
 
+    if do_captures:  # Input validation
+        im_file_ext = check_image_writer(im_file_ext)
+
     # Create a "capture configuration" dictionary that will contain key info about each capture, pertinent to the
-    # analysis and plotting of the data. The contents of this dictionary are populated after capturing each image.
-    # This dictionary is saved as a JSON-encoded text file after finishing with captures.
+    # analysis and plotting of the data. This dictionary is saved as a JSON-encoded text file, to which the "captures"
+    # entry (key info) for each capture is added after capturing each image.
     capture_config = dict(
         {
-            "captures": [],
             "run_name": "sample_run_123abc",
             "comment": "This is a sample capture config",
             "version": -1,
@@ -247,6 +719,46 @@ def run_sample_mg_capture_plan(
     az = capture_plan["azimuthAngles"]
     fa = capture_plan["fieldAngles"]
 
+    # Build the sequence of positions to visit before connecting to the Motorized Gimbal, so that no image file paths or
+    # capture_config entries have to be constructed between movement and image capture. Each position is defined by
+    # (position index, azimuth angle, field angle, image file path, capture_config entry)
+    capture_sequence = []
+    for a in range(len(az)):
+        # Sweep the field angles in alternating directions (serpentine order), if specified
+        if serpentine_order and a % 2 == 1:
+            fa_indices = reversed(range(len(fa)))
+        else:
+            fa_indices = range(len(fa))
+
+        for f in fa_indices:
+            position_idx = len(capture_sequence) + 1
+
+            # Construct the path to the output image file to be captured for this position
+            # The as-written image file naming is, for example: 'C:/path/to/output_dir/cap00001.tif'
+            # (a str is constructed from output_dir_str, since pathlib.Path objects would be resolved for each position)
+            im_file_path = f"{output_dir_str}/cap{position_idx:05d}.{im_file_ext}"
+
+            # Information about this capture, added to the capture config file after capturing the image
+            capture_entry = dict(
+                {
+                    "image_paths": im_file_path,
+                    "source_field_angle_deg": fa[f],
+                    "source_azimuth_angle_deg": az[a],
+                    "source_comment": "",
+                }
+            )
+
+            # Adjust angles based on center-aligned/reference position
+            capture_sequence.append(
+                (
+                    position_idx,
+                    az[a] - ref_az,
+                    fa[f] - ref_fa,
+                    im_file_path,
+                    capture_entry,
+                )
+            )
+
     # ============================================================
     # Connect to the Motorized Gimbal using Zaber's Python library
     # ============================================================
@@ -254,20 +766,38 @@ def run_sample_mg_capture_plan(
     # The library connects to the internet to retrieve information about Zaber devices.
     # Calling the method enable_device_db_store makes the library store the downloaded information to later allow for
     # offline use. This line can optionally be commented out after the first run.
-    Library.enable_device_db_store()
+    # (This only has to be called once per Python process.)
+    global _device_db_store_enabled
+    if not _device_db_store_enabled:
+        Library.enable_device_db_store()
+        _device_db_store_enabled = True
 
     # Initialize connection to Zaber devices
     with Connection.open_serial_port(com_port) as connection:
         # Get list of Zaber devices
-        device_list = connection.detect_devices()
-        print(f"Found {len(device_list)} devices:")
-        print(device_list)
+        if skip_detect and com_port in _detected_device_addresses:
+            # Reuse the devices detected by a previous call, which only requires identifying each device rather than
+            # scanning for all devices on the connection
+            device_list = [
+                connection.get_device(device_address)
+                for device_address in _detected_device_addresses[com_port]
+            ]
+            for device in device_list:
+                device.identify()
+            logger.info("Using %d previously detected devices:", len(device_list))
+        else:
+            device_list = connection.detect_devices()
+            _detected_device_addresses[com_port] = [
+                device.device_address for device in device_list
+            ]
+            logger.info("Found %d devices:", len(device_list))
+        logger.info("%s", device_list)
 
         # (Optional) Home all axes of the detected Zaber devices
         if do_home:
             for device in device_list:
-                print(
-                    f"Homing all axes of device with address {device.device_address}."
+                logger.info(
+                    "Homing all axes of device with address %s.", device.device_address
                 )
                 device.all_axes.home()
 
@@ -279,108 +809,153 @@ def run_sample_mg_capture_plan(
         # ============================================================
 
         # Move to each of the defined azimuth angle and field angle positions
-        num_positions = len(az) * len(fa)  # Total number of positions
-        position_idx = 0
-        for a in range(len(az)):
-            for f in range(len(fa)):
-                position_idx += 1
-
-                # Adjust angles based on center-aligned/reference position
-                azimuth_angle = az[a] - ref_az
-                field_angle = fa[f] - ref_fa
-
-                # Construct the path to the output image file to be captured for this position
-                # The as-written image file naming is, for example: WindowsPath('C:/path/to/output_dir/cap00001.png')
-                im_file_path = pathlib.Path(
-                    output_dir, f"cap{position_idx:05d}.{im_file_ext}"
-                )
-
-                print(
-                    f"Moving to absolute position ({position_idx}/{num_positions}) with azimuth angle {azimuth_angle}"
-                    f" and field angle {field_angle} (degrees)..."
-                )
-                # Move both axes simultaneously, wait until both axes are done moving
-                axis_az.move_absolute(
-                    azimuth_angle,
-                    Units.ANGLE_DEGREES,
-                    wait_until_idle=False,
-                    velocity=50,
-                    acceleration=50,
-                    velocity_unit=Units.ANGULAR_VELOCITY_DEGREES_PER_SECOND,
-                    acceleration_unit=Units.ANGULAR_ACCELERATION_DEGREES_PER_SECOND_SQUARED,
-                )
-                axis_fa.move_absolute(
-                    field_angle,
-                    Units.ANGLE_DEGREES,
-                    wait_until_idle=False,
-                    velocity=50,
-                    acceleration=50,
-                    velocity_unit=Units.ANGULAR_VELOCITY_DEGREES_PER_SECOND,
-                    acceleration_unit=Units.ANGULAR_ACCELERATION_DEGREES_PER_SECOND_SQUARED,
-                )
-                axis_az.wait_until_idle()
-                axis_fa.wait_until_idle()
-                print("Movement complete.")
-
-                # Pause before capture
-                time.sleep(pause_time_s)
-
-                # Capture and save image
-                if do_captures:
-                    print("Capturing image...")
-                    capture_image(im_file_path)
-                    print("Image capture complete.")
-
-                # Add information about this capture to the capture_config dictionary:
-                # This dictionary is saved as a JSON-encoded text file after finishing with captures.
-                capture_config["captures"].append(
-                    dict(
-                        {
-                            "image_paths": im_file_path,
-                            "source_field_angle_deg": fa[f],
-                            "source_azimuth_angle_deg": az[a],
-                            "source_comment": "",
-                        }
-                    )
-                )
-
-        # Move both axes back to the center-aligned/reference position
-        axis_az.move_absolute(
-            ref_az,
-            Units.ANGLE_DEGREES,
-            velocity=50,
-            acceleration=50,
-            velocity_unit=Units.ANGULAR_VELOCITY_DEGREES_PER_SECOND,
-            acceleration_unit=Units.ANGULAR_ACCELERATION_DEGREES_PER_SECOND_SQUARED,
-        )
-        axis_fa.move_absolute(
-            ref_fa,
-            Units.ANGLE_DEGREES,
-            velocity=50,
-            acceleration=50,
-            velocity_unit=Units.ANGULAR_VELOCITY_DEGREES_PER_SECOND,
-            acceleration_unit=Units.ANGULAR_ACCELERATION_DEGREES_PER_SECOND_SQUARED,
-        )
-        print("Captures complete.")
-
-        # Save the capture_config dictionary as a JSON-encoded text file to the output_dir
-        # This file will contain key information about each capture, pertinent to analysis and plotting of the data
-        print("Writing configuration file...")
-        capture_config_file_path = pathlib.Path(output_dir, "config.slconf")
-        with capture_config_file_path.open(mode="w") as capture_config_file:
-            json.dump(capture_config, capture_config_file)
-
-        print("Done.")
+        num_positions = len(capture_sequence)  # Total number of positions
+        # Previously commanded angles, used to skip the movement of (and the pause for) axes whose angle is unchanged
+        prev_azimuth_angle = None
+        prev_field_angle = None
+
+        # Open the capture config file in the output_dir, which will contain key information about each capture,
+        # pertinent to analysis and plotting of the data
+        if do_captures:
+            logger.info("Writing configuration file during captures...")
+            capture_config_file_context = open_capture_config_file(
+                pathlib.Path(output_dir_str, "config.slconf"), capture_config
+            )
+        else:
+            capture_config_file_context = contextlib.nullcontext()
+
+        # Console output for each position is logged at the DEBUG level, since printing to the console can take a
+        # significant amount of time on some systems. The overall progress is displayed with a progress bar instead.
+        if tqdm is not None:
+            capture_sequence_iter = tqdm(capture_sequence, unit="position")
+            # Log messages are written through tqdm, so that they don't break up the progress bar
+            logging_context = logging_redirect_tqdm()
+        else:
+            capture_sequence_iter = capture_sequence
+            logging_context = contextlib.nullcontext()
+
+        with logging_context, capture_config_file_context as write_capture_entry:
+            # Acquired images are saved on worker threads, so that the next movement can start as soon as an image has
+            # been acquired. The Motorized Gimbal is not moved until the image for a position has been acquired, so that
+            # each image is taken at its intended position.
+            # The capture config entry for an image is only written once the image has been saved, in capture order, so
+            # that the capture config file only lists images that have been saved.
+            pending_saves = threading.BoundedSemaphore(max_pending_saves)
+            pending_captures: typing.Deque[
+                typing.Tuple[concurrent.futures.Future, typing.Dict[str, typing.Any]]
+            ] = collections.deque()
+            try:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=num_save_workers
+                ) as save_executor:
+                    for (
+                        position_idx,
+                        azimuth_angle,
+                        field_angle,
+                        im_file_path,
+                        capture_entry,
+                    ) in capture_sequence_iter:
+                        logger.debug(
+                            "Moving to absolute position (%d/%d) with azimuth angle %s and field angle %s (degrees)...",
+                            position_idx,
+                            num_positions,
+                            azimuth_angle,
+                            field_angle,
+                        )
+                        # Move both axes simultaneously, wait until both axes are done moving
+                        # Axes whose angle is unchanged from the previous position are not commanded, since each
+                        # command is a round-trip over the serial connection (e.g., the azimuth angle only changes
+                        # between sweeps)
+                        # The displacement of an axis is unknown before its first movement
+                        axis_moves = []
+                        axis_displacements_deg = []
+                        if azimuth_angle != prev_azimuth_angle:
+                            axis_moves.append((axis_az, azimuth_angle))
+                            axis_displacements_deg.append(
+                                float("inf")
+                                if prev_azimuth_angle is None
+                                else abs(azimuth_angle - prev_azimuth_angle)
+                            )
+                        if field_angle != prev_field_angle:
+                            axis_moves.append((axis_fa, field_angle))
+                            axis_displacements_deg.append(
+                                float("inf")
+                                if prev_field_angle is None
+                                else abs(field_angle - prev_field_angle)
+                            )
+                        move_axes_absolute(axis_moves, velocity)
+                        logger.debug("Movement complete.")
+
+                        # Pause before capture, to let the camera and mount settle (skipped if the axes did not move)
+                        time.sleep(
+                            get_settle_time_s(
+                                axis_displacements_deg, pause_time_s, velocity
+                            )
+                        )
+                        prev_azimuth_angle = azimuth_angle
+                        prev_field_angle = field_angle
+
+                        # Capture image
+                        if do_captures:
+                            logger.debug("Capturing image...")
+                            image = acquire_image()
+                            logger.debug("Image capture complete.")
+
+                            # Save image on a worker thread
+                            # (waits while max_pending_saves acquired images are still waiting to be saved)
+                            pending_saves.acquire()
+                            save_future = save_executor.submit(
+                                save_image, im_file_path, image
+                            )
+                            save_future.add_done_callback(
+                                lambda _: pending_saves.release()
+                            )
+                            pending_captures.append((save_future, capture_entry))
+
+                            # Add information about the captures whose images have been saved to the capture config file
+                            # (result() re-raises any exception raised by save_image, which stops the capture plan)
+                            while pending_captures and pending_captures[0][0].done():
+                                save_future, saved_capture_entry = (
+                                    pending_captures.popleft()
+                                )
+                                save_future.result()
+                                write_capture_entry(saved_capture_entry)
+            finally:
+                # All images have been saved once the save_executor is shut down (exiting the "with" block), also if the
+                # capture plan is interrupted (e.g., by an exception or Ctrl+C). Add the information about the remaining
+                # captures whose images have been saved, without raising the exceptions of failed saves, which would
+                # replace an exception that interrupted the capture plan.
+                for save_future, saved_capture_entry in pending_captures:
+                    if (
+                        save_future.done()
+                        and not save_future.cancelled()
+                        and save_future.exception() is None
+                    ):
+                        write_capture_entry(saved_capture_entry)
+
+            # Re-raise the first exception raised by save_image, if any, once the capture config file is complete
+            for save_future, _ in pending_captures:
+                save_future.result()
+
+        # Move both axes back to the center-aligned/reference position (simultaneously)
+        move_axes_absolute(((axis_az, ref_az), (axis_fa, ref_fa)), velocity)
+        logger.info("Captures complete.")
+
+        logger.info("Done.")
 
 
 def main():
+    # Display INFO level messages (e.g., "Captures complete.") on the console. Use level=logging.DEBUG to also display
+    # the messages for each Motorized Gimbal position.
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # First define the Path (pathlib.Path) to an output directory, used for saving images and output files
     # (Paste your directory path between the two quotes)
     output_dir = pathlib.Path(r"C:/path/to/existing/output_dir")  # Example: WindowsPath('C:/path/to/output_dir')
     # If left empty or if the path doesn't exist, the run_sample_mg_capture_plan() function will not perform image
     # capture at each Motorized Gimbal position
 
-    im_file_ext = "png"  # File extension to use for saving image files
+    im_file_ext = "tif"  # File extension to use for saving image files (uncompressed TIFF is fastest to save)
 
     com_port = "COM4"  # COM port associated with the Motorized Gimbal Zaber connection
 
@@ -390,7 +965,7 @@ def main():
     az_zaber_device_idx = 1  # azimuth angle device index
     fa_zaber_device_idx = 0  # field angle device index
 
-    pause_time_s = 0.5  # Pause time (seconds) between Motorized Gimbal movement and image capture call
+    pause_time_s = 0.5  # Maximum pause time (seconds) between Motorized Gimbal movement and image capture call
     do_home = False  # Home all Motorized Gimbal axes before executing capture plan?
 
     # Reference azimuth and field angle (in degrees) for the Motorized Gimbal, corresponding to the absolute position